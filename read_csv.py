@@ -1,15 +1,17 @@
-import csv
+import pandas as pd
 
-unique_terms = set()
+# The split and the uniqueness pass both run inside pandas' C string
+# kernels instead of a per-row Python loop
+terms = (
+    pd.read_csv(
+        "vb_scan_2020_11_12.csv",
+        usecols=["identificationRemarks"],
+        dtype=str,
+        na_filter=False,
+    )["identificationRemarks"]
+    .str.split(";")
+    .explode()
+    .unique()
+)
 
-with open("vb_scan_2020_11_12.csv", "r") as f:
-    reader = csv.DictReader(f)
-
-    for line in reader:
-        string = line["identificationRemarks"]
-        terms = string.split(";")
-
-        for term in terms:
-            if term not in unique_terms:
-                unique_terms.add(term)
-                print(term)
+print("\n".join(terms))
@@ -1,14 +1,13 @@
-import json
+import ijson
 
 unique_terms = set()
 
-with open("raw_data.json", "r") as f:
-    js = json.load(f)
+with open("raw_data.json", "rb") as f:
+    # Stream just the species lists; docs without one are skipped and the
+    # rest of each doc is never materialized
+    for species in ijson.items(f, "response.docs.item.species"):
+        term = tuple(species)
 
-    for record in js["response"]["docs"]:
-        if "species" in record:
-            term = tuple(record["species"])
-
-            if term not in unique_terms:
-                unique_terms.add(term)
-                print(term)
+        if term not in unique_terms:
+            unique_terms.add(term)
+            print(term)
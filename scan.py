@@ -3,11 +3,22 @@
 ################
 
 import argparse
-import csv
+import gc
+import mmap
+import multiprocessing
 import os
+import queue
 import random
+import re
 import requests
-import json
+import threading
+
+try:
+    # Prefer the C-accelerated yajl2 parser; the pure-Python backend is an
+    # order of magnitude slower on a full export
+    import ijson.backends.yajl2_c as ijson
+except ImportError:
+    import ijson
 
 
 # Configuration
@@ -67,6 +78,23 @@ output_rows = [
     "occurrenceRemarks",
 ]
 
+# Column name -> position, computed once so the hot loop can fill a
+# positional row instead of allocating and hashing a fresh dict per record
+output_columns = {name: i for i, name in enumerate(output_rows)}
+
+# The row-independent prefix of the popbio map link embedded in
+# occurrenceRemarks; per-row query parameters are appended to it
+link_prefix = "https://vectorbase.org/popbio-map/web/?view=abnd&zoom_level=11&center="
+
+# The occurrenceRemarks sentence, with slots for the author, link and
+# generator fragments; %-formatting fills it without parsing a format
+# spec per record
+remarks_template = (
+    "This record has been curated by VectorBase.org as part of a larger data set%s"
+    " which can be seen in context at %s. Please cite VectorBase and the original "
+    "data generator(s)%s."
+)
+
 # Species strings to transform to other strings
 transform_species_strings = {
     "Anopheles gambiae x Anopheles coluzzii": "Anopheles gambiae sensu lato",
@@ -74,7 +102,7 @@ transform_species_strings = {
 }
 
 # The first species term must appear in this set
-valid_first_species_terms = {
+valid_first_species_terms = frozenset({
     "Aedeomyia",
     "Aedes",
     "Aedimorphus",
@@ -113,19 +141,19 @@ valid_first_species_terms = {
     "Ixodes",
     "Rhipicephalus",
     "Armigeres",
-}
+})
 
 # The third species term must appear in one of the following two sets
-subspecies_terms = {
+subspecies_terms = frozenset({
     "japonicus",
     "arabiensis",
     "vexans",
     "S",
     "T",
     "pallens",
-}
+})
 
-group_terms = {
+group_terms = frozenset({
     "morphological",
     "group",
     "complex",
@@ -134,13 +162,27 @@ group_terms = {
     "AD",
     "BCE",
     "subgroup",
-}
+})
+
+# Classification of known third species terms, precomputed so the hot
+# path does one dict lookup instead of two set membership tests: True
+# means the term extends the scientific name, False means it becomes the
+# identification qualifier
+third_species_term_kinds = dict.fromkeys(subspecies_terms, True)
+third_species_term_kinds.update(dict.fromkeys(group_terms, False))
+
+# Splits a species string into up to four terms in one C-level pass,
+# dropping an optional leading genus/subgenus marker. Anything past the
+# third term is captured whole as the fourth
+species_term_pattern = re.compile(
+    r"(?:(?:genus|subgenus)\s+)?(\S+)(?:\s+(\S+))?(?:\s+(\S+))?(?:\s+(.+))?$"
+)
 
 # Tags to remove from the tags list
-remove_tags = {"abundance", "viral surveillance"}
+remove_tags = frozenset({"abundance", "viral surveillance"})
 
 # The provider tag must appear in this set
-valid_provider_tags = {
+valid_provider_tags = frozenset({
     "Anastasia Mosquito Control District Florida",
     "Marion County Public Health Department Indiana",
     "Hernando County Florida Mosquito Control",
@@ -178,23 +220,438 @@ valid_provider_tags = {
     "Maryland Department of Agriculture",
     "Florida Keys Mosquito Control District",
     "Volusia County Mosquito Control",
+})
+
+# The (author text, link parameter) remark fragments for each known
+# provider tag, precomputed so the hot loop looks them up instead of
+# rebuilding the same two strings per record. Unknown tags are added
+# lazily by get_tag_fragments()
+tag_fragments = {
+    tag: (" authored by " + tag, "&tag=" + tag.replace(" ", "+"))
+    for tag in valid_provider_tags
 }
 
 # Skip records with any of these provider tags
-skip_provider_tags = set()
+skip_provider_tags = frozenset()
 
 # Collection protocols must appear in this set
-valid_protocols = {
+valid_protocols = frozenset({
     "morphological examination",
     "PCR-based species identification",
     "by size",
-}
+})
 
 # Skip records with any of these collection protocols
-skip_protocols = {"BG-Counter trap catch"}
+skip_protocols = frozenset({"BG-Counter trap catch"})
 
 # IDs of projects to skip
-skip_projects = set()
+skip_projects = frozenset()
+
+# Solr fields that hold multiple values; everything else is a scalar
+multivalued_solr_fields = frozenset({
+    "projects",
+    "species",
+    "collection_protocols",
+    "collection_date_range",
+    "protocols",
+    "exp_citations_ss",
+    "tags_ss",
+    "dev_stages_ss",
+    "project_authors_txt",
+})
+
+# Records per batch when converting the cache to Parquet
+parquet_batch_size = 65536
+
+# Bytes to accumulate in the output buffer between writes
+write_buffer_size = 2 ** 20
+
+# Records between progress prints and between forced gc passes
+progress_interval = 10000
+collect_interval = 100000
+
+# Docs buffered between the reader thread and the transform loop
+reader_queue_size = 4096
+
+# Sentinel marking the end of the reader thread's doc stream
+queue_end = object()
+
+
+# Matches any character that forces a CSV field to be quoted
+csv_quote_needed = re.compile(r'[",\r\n]').search
+
+
+def csv_field(value):
+    """Format one value as a CSV field, quoting only when necessary.
+
+    The generic csv module runs its quoting state machine on every field;
+    almost all of ours (IDs, dates, coordinates, fixed vocabulary) never
+    need quoting, so a single character-class scan decides instead.
+    """
+
+    value = str(value)
+
+    if csv_quote_needed(value):
+        return '"' + value.replace('"', '""') + '"'
+
+    return value
+
+
+def get_tag_fragments(tag):
+    """Return the cached (author text, link parameter) pair for a tag."""
+
+    fragments = tag_fragments.get(tag)
+
+    if fragments is None:
+        fragments = (" authored by " + tag, "&tag=" + tag.replace(" ", "+"))
+        tag_fragments[tag] = fragments
+
+    return fragments
+
+
+class TeeReader:
+    """File-like wrapper that copies everything read through it to a cache file."""
+
+    def __init__(self, source, cache_file):
+        self.source = source
+        self.cache_file = cache_file
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.cache_file.write(data)
+        return data
+
+
+def iter_threaded(docs):
+    """Yield docs pulled from a background reader thread.
+
+    Draining the source iterator on its own thread lets the network read
+    and JSON parse overlap with the transform work in this process; both
+    sides spend much of their time outside the GIL. The bounded queue
+    keeps memory flat if either side stalls. An exception raised by the
+    source is forwarded and re-raised here.
+    """
+
+    doc_queue = queue.Queue(maxsize=reader_queue_size)
+
+    def read_docs():
+        try:
+            for record in docs:
+                doc_queue.put(record)
+        except BaseException as error:
+            doc_queue.put(error)
+            return
+
+        doc_queue.put(queue_end)
+
+    thread = threading.Thread(target=read_docs, daemon=True)
+    thread.start()
+
+    while True:
+        record = doc_queue.get()
+
+        if record is queue_end:
+            break
+
+        if isinstance(record, BaseException):
+            raise record
+
+        yield record
+
+    thread.join()
+
+
+def iter_json_cache():
+    """Stream Solr docs out of raw_data.json one at a time."""
+
+    with open("raw_data.json", "rb") as raw_data_file:
+        # Memory-map the cache so the kernel pages it in on demand instead
+        # of copying every read through the buffered I/O layer
+        raw_data_map = mmap.mmap(raw_data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(raw_data_map, "madvise"):  # Python 3.8+
+            raw_data_map.madvise(mmap.MADV_SEQUENTIAL)
+
+        try:
+            for record in ijson.items(
+                raw_data_map, "response.docs.item", use_float=True
+            ):
+                yield record
+        finally:
+            raw_data_map.close()
+
+
+def iter_cached_docs():
+    """Yield Solr docs from the local cache.
+
+    Prefers raw_data.parquet, which is both much smaller than the JSON
+    cache and read back without any text parsing. The first cached run
+    after a fetch streams raw_data.json once and writes the Parquet file
+    as a side effect, so every later run skips JSON entirely. A Parquet
+    file older than raw_data.json is treated as stale and regenerated, so
+    a fresh --write-cache fetch is never shadowed by an old conversion.
+    Falls back to plain JSON streaming when pyarrow isn't installed.
+    """
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        for record in iter_json_cache():
+            yield record
+        return
+
+    fields = []
+    for name in solr_fields:
+        if name == "sample_size_i":
+            field_type = pa.int64()
+        elif name in multivalued_solr_fields:
+            field_type = pa.list_(pa.string())
+        else:
+            field_type = pa.string()
+        fields.append((name, field_type))
+    schema = pa.schema(fields)
+
+    # Only trust the Parquet cache if it's at least as new as the JSON it
+    # was converted from; a later --write-cache fetch invalidates it
+    parquet_fresh = os.path.exists("raw_data.parquet") and (
+        not os.path.exists("raw_data.json")
+        or os.path.getmtime("raw_data.parquet") >= os.path.getmtime("raw_data.json")
+    )
+
+    if parquet_fresh:
+        table = pq.read_table("raw_data.parquet", memory_map=True)
+
+        for batch in table.to_batches():
+            for record in batch.to_pylist():
+                # Fields a doc didn't have come back as None; drop them so
+                # the transform applies its defaults, as with JSON
+                yield {k: v for k, v in record.items() if v is not None}
+
+        return
+
+    print("Converting raw_data.json to raw_data.parquet...")
+
+    temp = "raw_data.parquet.temp"
+    writer = pq.ParquetWriter(temp, schema, compression="zstd")
+    batch = []
+    converted = False
+
+    try:
+        for record in iter_json_cache():
+            batch.append(record)
+
+            if len(batch) >= parquet_batch_size:
+                writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+                batch.clear()
+
+            yield record
+
+        if batch:
+            writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+
+        converted = True
+    finally:
+        writer.close()
+
+        # Don't leave a half-written temp file behind if the conversion
+        # (or the run consuming it) aborted partway
+        if not converted and os.path.exists(temp):
+            os.remove(temp)
+
+    os.replace(temp, "raw_data.parquet")
+
+
+def transform_record(
+    record,
+    remove_tags=remove_tags,
+    valid_provider_tags=valid_provider_tags,
+    skip_provider_tags=skip_provider_tags,
+    skip_protocols=skip_protocols,
+    skip_projects=skip_projects,
+    valid_protocols=valid_protocols,
+    transform_species_strings=transform_species_strings,
+    species_term_pattern=species_term_pattern,
+    valid_first_species_terms=valid_first_species_terms,
+    third_species_term_kinds=third_species_term_kinds,
+    output_columns=output_columns,
+    link_prefix=link_prefix,
+    get_tag_fragments=get_tag_fragments,
+    remarks_template=remarks_template,
+):
+    """Transform one Solr doc into an output row.
+
+    Returns a (line, problems) pair, or bare None for a discarded record
+    with nothing to report. line is the UTF-8-encoded CSV output line
+    (without terminator), or None if the record should be discarded. problems is a
+    list of (category, key, message) tuples; the caller deduplicates them
+    on (category, key) so each distinct problem is only reported once.
+
+    The keyword arguments just rebind the module-level lookup tables as
+    locals, so the per-record code resolves them with LOAD_FAST instead of
+    a global lookup on every use. Don't pass them explicitly.
+    """
+
+    problems = []
+
+    tags = []
+
+    if "tags_ss" in record:
+        tags = [tag for tag in record["tags_ss"] if tag not in remove_tags]
+
+        if len(tags) > 0 and (len(tags) > 1 or tags[0] not in valid_provider_tags):
+            problems.append(
+                (
+                    "tags",
+                    ",".join(tags),
+                    "Unexpected tag(s) {} at {}".format(tags, record["sample_id_s"]),
+                )
+            )
+
+    # Fields that are read more than once; everything else is fetched with
+    # record.get() at its single use site, so absent fields cost nothing
+    projects = record.get("projects", ("",))
+    collection_protocols = record.get("collection_protocols", ("",))
+    citations = record.get("exp_citations_ss", ("",))
+
+    # Discard the row based on certain conditions
+    if (
+        (tags and tags[0] in skip_provider_tags)
+        or any(s in skip_protocols for s in collection_protocols)
+        or any(s in skip_projects for s in projects)
+    ):
+        # Plain None when there's nothing to report, so the common discard
+        # case sends the smallest possible result back from the workers
+        return (None, problems) if problems else None
+
+    col = output_columns
+    out = [""] * len(output_rows)
+
+    # Directly set the fields that need little processing
+    out[col["occurrenceID"]] = record["sample_id_s"]
+    out[col["catalogNumber"]] = record["sample_id_s"]
+    out[col["dataGeneralizations"]] = ";".join(projects)
+    out[col["basisOfRecord"]] = "HumanObservation"
+    out[col["individualCount"]] = record["sample_size_i"]
+    out[col["sex"]] = record.get("sex_s", "")
+    out[col["lifeStage"]] = ";".join(record.get("dev_stages_ss", ("",)))
+    out[col["references"]] = ";".join(citations)
+    out[col["recordedBy"]] = ";".join(record.get("project_authors_txt", ("",)))
+    out[col["verbatimEventDate"]] = ";".join(record.get("collection_date_range", ("",)))
+    out[col["samplingProtocol"]] = ";".join(collection_protocols)
+
+    # identificationRemarks
+    # sorted() keeps the joined value deterministic across runs, since set
+    # intersection has no defined order
+    out[col["identificationRemarks"]] = ";".join(
+        sorted(valid_protocols.intersection(record.get("protocols", ())))
+    )
+
+    # Species
+    # strip() first: leading whitespace would make the pattern fail to match,
+    # and trailing whitespace would backtrack it into the wrong groups
+    species_string = record["species"][0].strip()
+
+    if species_string in transform_species_strings:
+        species_string = transform_species_strings[species_string]
+
+    species_match = species_term_pattern.match(species_string)
+
+    if species_match is None:
+        problems.append(
+            (
+                "species_string",
+                species_string,
+                'Unparseable species string "{}" at {}'.format(
+                    species_string, record["sample_id_s"]
+                ),
+            )
+        )
+        return None, problems
+
+    (
+        first_species_term,
+        second_species_term,
+        third_species_term,
+        fourth_species_term,
+    ) = species_match.groups()
+
+    if first_species_term not in valid_first_species_terms:
+        problems.append(
+            (
+                "first_species_term",
+                first_species_term,
+                'Unknown first species term "{}" at {}'.format(
+                    first_species_term, record["sample_id_s"]
+                ),
+            )
+        )
+
+    out[col["scientificName"]] = first_species_term
+
+    if second_species_term:
+        out[col["scientificName"]] += " " + second_species_term
+
+        if third_species_term:
+            term_kind = third_species_term_kinds.get(third_species_term)
+
+            if term_kind:
+                out[col["scientificName"]] += " " + third_species_term
+            elif term_kind is False:
+                out[col["identificationQualifier"]] = third_species_term
+            else:
+                problems.append(
+                    (
+                        "third_species_term",
+                        third_species_term,
+                        'Unknown third species term "{}" at {}'.format(
+                            third_species_term, record["sample_id_s"]
+                        ),
+                    )
+                )
+
+            if fourth_species_term:
+                if out[col["identificationQualifier"]]:
+                    out[col["identificationQualifier"]] += " "
+
+                out[col["identificationQualifier"]] += fourth_species_term
+
+    # Coordinates
+    coordinates = record["geo_coords"].split(",", 1)
+    out[col["decimalLatitude"]] = coordinates[0]
+    out[col["decimalLongitude"]] = coordinates[1]
+
+    # Location; partition() takes the head without building a list and
+    # stops at the first match
+    out[col["country"]] = record.get("country_s", "").partition(" (")[0]
+    out[col["stateProvince"]] = record.get("adm1_s", "").partition(" (")[0]
+    out[col["locality"]] = record.get("adm2_s", "").partition(" (")[0]
+
+    # Date
+    out[col["eventDate"]] = record.get("collection_day_s", "")[:10]
+
+    # occurrenceRemarks
+    author_text = generator_text = ""
+    link_parts = [link_prefix, record["geo_coords"]]
+
+    if tags:
+        author_text, tag_link = get_tag_fragments(tags[0])
+        link_parts.append(tag_link)
+    else:
+        for project in projects:
+            link_parts.append("&projectID[]=" + project)
+
+    link = "".join(link_parts)
+
+    if citations[0]:
+        generator_text = ", including " + "; ".join(citations)
+
+    out[col["occurrenceRemarks"]] = remarks_template % (
+        author_text,
+        link,
+        generator_text,
+    )
+
+    return ",".join(map(csv_field, out)).encode("utf-8"), problems
 
 
 def parse_args():
@@ -209,7 +666,25 @@ def parse_args():
         "-c",
         "--use-cached",
         action="store_true",
-        help="use the previously-generated raw_data.json file instead of requesting new data from Solr",
+        help="use the locally cached data (raw_data.parquet, or the "
+        "raw_data.json written by a previous --write-cache run) instead of "
+        "requesting new data from Solr",
+    )
+    parser.add_argument(
+        "-w",
+        "--write-cache",
+        action="store_true",
+        help="write the raw Solr response to raw_data.json while processing, "
+        "for later runs with --use-cached",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="the number of worker processes to transform records with. "
+        "Defaults to the number of CPUs; pass 1 to process records in the "
+        "main process",
     )
     parser.add_argument(
         "-s",
@@ -227,12 +702,14 @@ def parse_args():
     return args
 
 
-def make_scan(output, use_cached=False, sample=None):
+def make_scan(output, use_cached=False, write_cache=False, sample=None, jobs=None):
     if sample:
         random.seed()
 
     temp = output + ".temp"
 
+    cache_file = response = session = None
+
     if not use_cached:
         url = solr_url
         url += "?fl=" + ",".join(solr_fields)
@@ -245,195 +722,137 @@ def make_scan(output, use_cached=False, sample=None):
         )
         url += "&q=*:*"
         url += "&rows=" + str(rows)
+        url += "&wt=json&indent=off"
 
         print("Sending request...")
-        response = requests.get(url)
-        print("Done.")
-        response.raise_for_status()
-
-        with open("raw_data.json", "w", newline="") as raw_data_file:
-            raw_data_file.write(response.text)
 
-        response = response.json()
-
-    else:
-        print("Loading raw data into memory...")
-        with open("raw_data.json") as raw_data_file:
-            response = json.load(raw_data_file)
-        print("Done.")
+        # Solr JSON is highly repetitive and compresses several-fold, so
+        # ask for it gzipped; urllib3 decompresses transparently as
+        # response.raw is read
+        session = requests.Session()
+        session.headers["Accept-Encoding"] = "gzip, deflate"
+        session.mount(
+            "https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        )
 
-    problems = []
-    problem_tags = set()
-    problem_first_species_terms = set()
-    problem_third_species_terms = set()
-
-    with open(temp, "w", newline="") as temp_file:
-        temp_csv = csv.DictWriter(temp_file, output_rows)
-
-        temp_csv.writeheader()
-
-        i = 0
-
-        for record in response["response"]["docs"]:
-            defaults = {
-                "projects": [""],
-                "country_s": "",
-                "adm1_s": "",
-                "adm2_s": "",
-                "collection_protocols": [""],
-                "collection_day_s": "",
-                "collection_date_range": [""],
-                "protocols": [""],
-                "exp_citations_ss": [""],
-                "sex_s": "",
-                "dev_stages_ss": [""],
-                "project_authors_txt": [""],
-            }
-
-            defaults.update(record)
-            record = defaults
-
-            i += 1
-
-            if not i % 10000:
-                print(i)
-
-            # If we're sampling, drop the row with some probability
-            if sample is not None and random.random() >= sample / 100:
-                continue
-
-            tags = []
-
-            if "tags_ss" in record:
-                tags = [tag for tag in record["tags_ss"] if tag not in remove_tags]
-
-                if len(tags) > 0 and (
-                    len(tags) > 1 or tags[0] not in valid_provider_tags
-                ):
-                    tags_text = ",".join(tags)
-                    if tags_text not in problem_tags:
-                        problem_tags.add(tags_text)
-                        problems.append(
-                            "Unexpected tag(s) {} at {}".format(
-                                tags, record["sample_id_s"]
-                            )
-                        )
-
-            # Discard the row based on certain conditions
-            if (
-                (tags and tags[0] in skip_provider_tags)
-                or any(s in skip_protocols for s in record["collection_protocols"])
-                or any(s in skip_projects for s in record["projects"])
-            ):
-                continue
-
-            # Directly set the fields that need little processing
-            output_row = {
-                "occurrenceID": record["sample_id_s"],
-                "catalogNumber": record["sample_id_s"],
-                "dataGeneralizations": ";".join(record["projects"]),
-                "basisOfRecord": "HumanObservation",
-                "individualCount": record["sample_size_i"],
-                "sex": record["sex_s"],
-                "lifeStage": ";".join(record["dev_stages_ss"]),
-                "references": ";".join(record["exp_citations_ss"]),
-                "recordedBy": ";".join(record["project_authors_txt"]),
-                "verbatimEventDate": ";".join(record["collection_date_range"]),
-                "samplingProtocol": ";".join(record["collection_protocols"]),
-            }
-
-            # identificationRemarks
-            output_row["identificationRemarks"] = ";".join(
-                [s for s in record["protocols"] if s in valid_protocols]
-            )
+        response = session.get(url, stream=True)
+        response.raise_for_status()
+        response.raw.decode_content = True
 
-            # Species
-            species_string = record["species"][0]
+        # Parse the response incrementally. With --write-cache the raw
+        # bytes are teed to the cache file as they stream in, so the cache
+        # costs no extra pass; without it nothing touches the disk
+        raw = response.raw
 
-            if species_string in transform_species_strings:
-                species_string = transform_species_strings[species_string]
+        if write_cache:
+            cache_file = open("raw_data.json", "wb")
+            raw = TeeReader(raw, cache_file)
 
-            species_terms = species_string.split()
+        docs = ijson.items(raw, "response.docs.item", use_float=True)
 
-            first_species_term = species_terms[0]
+        # Drain the download + parse on a reader thread so it overlaps
+        # with the transform work instead of alternating with it
+        docs = iter_threaded(docs)
 
-            if first_species_term == "genus" or first_species_term == "subgenus":
-                del species_terms[0]
-                first_species_term = species_terms[0]
+    else:
+        print("Streaming raw data from cache...")
+        docs = iter_cached_docs()
 
-            if first_species_term not in valid_first_species_terms:
-                if first_species_term not in problem_first_species_terms:
-                    problem_first_species_terms.add(first_species_term)
-                    problems.append(
-                        'Unknown first species term "{}" at {}'.format(
-                            first_species_term, record["sample_id_s"]
-                        )
-                    )
+    # If we're sampling, drop records with some probability before they
+    # reach the workers
+    if sample is not None:
+        docs = (record for record in docs if random.random() < sample / 100)
 
-            output_row["scientificName"] = first_species_term
-
-            if len(species_terms) >= 2:
-                output_row["scientificName"] += " " + species_terms[1]
-
-                if len(species_terms) >= 3:
-                    third_species_term = species_terms[2]
-                    if third_species_term in subspecies_terms:
-                        output_row["scientificName"] += " " + third_species_term
-                    elif third_species_term in group_terms:
-                        output_row["identificationQualifier"] = third_species_term
-                    else:
-                        if third_species_term not in problem_third_species_terms:
-                            problem_third_species_terms.add(third_species_term)
-                            problems.append(
-                                'Unknown third species term "{}" at {}'.format(
-                                    third_species_term, record["sample_id_s"]
-                                )
-                            )
-
-                    if len(species_terms) == 4:
-                        if "identificationQualifier" not in output_row:
-                            output_row["identificationQualifier"] = ""
-                        else:
-                            output_row["identificationQualifier"] += " "
-
-                        output_row["identificationQualifier"] += species_terms[3]
-
-            # Coordinates
-            coordinates = record["geo_coords"].split(",")
-            output_row["decimalLatitude"] = coordinates[0]
-            output_row["decimalLongitude"] = coordinates[1]
-
-            # Location
-            output_row["country"] = record["country_s"].split(" (")[0]
-            output_row["stateProvince"] = record["adm1_s"].split(" (")[0]
-            output_row["locality"] = record["adm2_s"].split(" (")[0]
-
-            # Date
-            output_row["eventDate"] = record["collection_day_s"][:10]
-
-            # occurrenceRemarks
-            author_text = generator_text = ""
-            link = "https://vectorbase.org/popbio-map/web/?view=abnd&zoom_level=11"
-            link += "&center=" + record["geo_coords"]
-
-            if tags:
-                author_text += " authored by " + tags[0]
-                link += "&tag=" + tags[0].replace(" ", "+")
+    problems = []
+    seen_problems = set()
+
+    success = False
+
+    try:
+        # Binary mode skips the text layer's per-write encoding and newline
+        # translation; rows arrive from the workers already UTF-8-encoded.
+        # Unbuffered, because the loop below does its own batching into a
+        # reusable bytearray and always writes in ~1 MiB chunks
+        with open(temp, "wb", buffering=0) as temp_file:
+            # The column names never need quoting
+            temp_file.write((",".join(output_rows) + "\r\n").encode("utf-8"))
+
+            # Records are independent, so fan the transformation out across
+            # cores; row order in the output doesn't matter
+            if jobs and jobs > 1:
+                pool = multiprocessing.Pool(jobs)
+                results = pool.imap_unordered(transform_record, docs, chunksize=2000)
             else:
-                for project in record["projects"]:
-                    link += "&projectID[]=" + project
-
-            if record["exp_citations_ss"][0]:
-                generator_text += ", including " + "; ".join(record["exp_citations_ss"])
-
-            output_row["occurrenceRemarks"] = (
-                "This record has been curated by VectorBase.org as part of a larger data set{}"
-                " which can be seen in context at {}. Please cite VectorBase and the original "
-                "data generator(s){}.".format(author_text, link, generator_text)
-            )
-
-            # Write to output
-            temp_csv.writerow(output_row)
+                pool = None
+                results = map(transform_record, docs)
+
+            i = 0
+            next_print = progress_interval
+            next_collect = collect_interval
+
+            # One buffer reused for the whole run; extend() amortizes to O(1)
+            # and clearing keeps the allocation around for the next batch
+            buffer = bytearray()
+
+            for result in results:
+                i += 1
+
+                if i >= next_print:
+                    print(i)
+                    next_print += progress_interval
+
+                # Periodically nudge the collector; the stream of short-lived
+                # parse objects otherwise fragments the heap
+                if i >= next_collect:
+                    gc.collect()
+                    next_collect += collect_interval
+
+                if result is None:
+                    continue
+
+                line, record_problems = result
+
+                for category, key, message in record_problems:
+                    if (category, key) not in seen_problems:
+                        seen_problems.add((category, key))
+                        problems.append(message)
+
+                if line is None:
+                    continue
+
+                # Write to output in batches to amortize the writer dispatch
+                buffer += line
+                buffer += b"\r\n"
+
+                if len(buffer) >= write_buffer_size:
+                    temp_file.write(buffer)
+                    del buffer[:]
+
+            if buffer:
+                temp_file.write(buffer)
+
+            if pool:
+                pool.close()
+                pool.join()
+
+            # Make sure the rows are on disk before the rename publishes them
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+
+        success = True
+    finally:
+        if response is not None:
+            response.close()
+        if session is not None:
+            session.close()
+        if cache_file:
+            cache_file.close()
+
+        # Don't leave a half-written temp file behind if anything above
+        # raised; a run that merely found data problems keeps it so the
+        # partial output can be inspected
+        if not success and os.path.exists(temp):
+            os.remove(temp)
 
     if problems:
         print("\nData problems:")